@@ -21,20 +21,20 @@ Polaris Anima EVO Comms Protocol:
 """
 
 
-import argparse
 import asyncio
-import errno
-import glob
+import contextlib
+import functools
+import json
 import logging
 import os
 import platform
 import re
+import stat
 import sys
 import time
 
-import aioserial
-import serial.tools.list_ports as lp
-from getch import pause_exit
+# aioserial and serial.tools.list_ports are imported where they're used, so the CLI doesn't load them for --help or
+# --version, or before the files to upload have been checked
 
 basedir = os.path.dirname(os.path.realpath(__file__))
 
@@ -42,6 +42,85 @@ script_version = "0.19.4"
 script_authors = "Jason Ramboz"
 script_repo = "https://github.com/jramboz/py2saber"
 
+_SYSTEM = platform.system()  # Doesn't change while running, and platform.system() isn't free
+
+
+def _get_cache_dir() -> str:
+    """Returns the per-user cache directory for py2saber, following each platform's convention."""
+    if _SYSTEM == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(r"~\AppData\Local")
+    elif _SYSTEM == "Darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "py2saber")
+
+
+# Port of the last saber successfully connected to, tried before searching all ports
+_LAST_PORT_FILE = os.path.join(_get_cache_dir(), "last_port.json")
+
+# Positive results of Saber_Controller.port_is_anima() and get_anima_ports(), keyed by port: (time.monotonic(), True)
+_anima_cache: dict[str, tuple[float, bool]] = {}
+
+# USB IDs of each saber found by Saber_Controller.get_anima_ports()/port_is_anima(), keyed by port: {"vid": ...,
+# "pid": ..., "serial_number": ...}. Saved along with the last port, so that port is only reused if the same saber is
+# still on it, and the same saber can be picked again if it comes back on a different port.
+_port_usb_ids: dict[str, dict] = {}
+
+# Results of Saber_Controller.get_ports() and get_anima_ports(), keyed by method name: (time.monotonic(), ports)
+_port_list_cache: dict[str, tuple[float, list[str]]] = {}
+
+# Serial device names considered by Saber_Controller.get_ports(), keyed by platform.system()
+_PORT_PATTERNS = {
+    "Darwin": re.compile(r"^/dev/cu\.usb"),
+    "Windows": re.compile(r"^COM\d+"),
+    "Linux": re.compile(r"^/dev/tty(USB|ACM|S)\d+"),
+}
+
+# One "NAME.RAW  size" line of the LIST? response
+_FILE_LIST_RE = re.compile(rb"^(\w+\.RAW)\s+(\d+)$", re.MULTILINE)
+
+# Command prefix for each color effect accepted by Saber_Controller.set_color()
+_COLOR_EFFECT_CMD = {"color": b"C", "clash": b"F", "swing": b"W"}
+
+# Command header for each sound effect accepted by Saber_Controller.set_sounds_for_effect()/get_sounds_for_effect()
+_SOUND_EFFECT_CMD = {
+    "on": b"sON",
+    "off": b"sOFF",
+    "hum": b"sHUM",
+    "swing": b"sSW",
+    "clash": b"sCL",
+    "smoothSwingA": b"sSMA",
+    "smoothSwingB": b"sSMB",
+}
+
+# Default file name prefix for each sound effect, used by Saber_Controller.auto_assign_sound_effects()
+_EFFECT_FILE_PREFIXES = {
+    "on": "POWERON",
+    "off": "POWEROFF",
+    "hum": "HUM",
+    "swing": "SWING",
+    "clash": "CLASH",
+    "smoothSwingA": "SMOOTHSWINGH",
+    "smoothSwingB": "SMOOTHSWINGL",
+}
+# Matches a file name against all of the prefixes at once; the name of the matching group is the effect
+_EFFECT_FILE_RE = re.compile(
+    "|".join(f"(?P<{effect}>{re.escape(prefix)})" for effect, prefix in _EFFECT_FILE_PREFIXES.items())
+)
+
+# Fixed saber commands, already newline-terminated so send_command() can send them as-is
+_CMD_WRITE_READY = b"WR?\n"
+_CMD_VERSION = b"V?\n"
+_CMD_SERIAL = b"S?\n"
+_CMD_LIST = b"LIST?\n"
+_CMD_ERASE_ALL = b"ERASE=ALL\n"
+_CMD_FREE = b"FREE?\n"
+_CMD_USED = b"USED?\n"
+_CMD_SIZE = b"SIZE?\n"
+_CMD_READ_CONFIG = b"RD?config.ini\n"
+_CMD_SAVE = b"SAVE\n"
+
 
 # adapted from https://stackoverflow.com/a/66491013
 class DocDefaultException(Exception):
@@ -79,15 +158,15 @@ class InvalidSoundEffectSpecifiedException(DocDefaultException):
     """Invalid sound effect specified."""
 
 
+_SIZE_SUFFIXES = ("B", "KB", "MB", "GB", "TB")  # Used by getHumanReadableSize()
+
+
 def getHumanReadableSize(size, precision=2):
     """Takes a size in bytes and outputs human-readable string."""
-    # taken from https://stackoverflow.com/a/32009595
-    suffixes = ["B", "KB", "MB", "GB", "TB"]
-    suffixIndex = 0
-    while size >= 1024 and suffixIndex < len(suffixes) - 1:
-        suffixIndex += 1  # increment the index of the suffix
-        size = size / 1024.0  # apply the division
-    return "%.*f%s" % (precision, size, suffixes[suffixIndex])
+    # adapted from https://stackoverflow.com/a/32009595
+    # Each suffix is another 10 bits, so the bit length picks the suffix without dividing in a loop
+    suffixIndex = min(max(int(size).bit_length() - 1, 0) // 10, len(_SIZE_SUFFIXES) - 1)
+    return "%.*f%s" % (precision, size / (1 << (10 * suffixIndex)), _SIZE_SUFFIXES[suffixIndex])
 
 
 class Saber_Controller:
@@ -102,15 +181,32 @@ class Saber_Controller:
         "xonxoff": False,
         "dsrdtr": False,
         "rtscts": False,
-        "timeout": 3,
+        "timeout": 0.5,  # Most commands are answered within a few ms; slow ones use _LONG_TIMEOUT
         "write_timeout": None,
         "inter_byte_timeout": None,
     }
 
     _CHUNK_SIZE = 128  # NXTs run into buffer problems if you try to send more than 128 bytes at a time
+    _UPLOAD_CHUNK_SIZE = 4096  # EVOs have no such limit, so file uploads go out in larger blocks
+    _CHUNK_DELAY = 0.012  # Seconds to pause after each _CHUNK_SIZE block so an NXT's receive buffer can keep up
 
     FILE_DELAY = 5  # Number of seconds to pause between file uploads
 
+    _PROGRESS_INTERVAL = 0.1  # Minimum number of seconds between upload progress updates
+
+    _WINDOWS_BUFFER_SIZE = 65536  # Serial driver RX/TX buffer size requested on Windows
+
+    _LONG_TIMEOUT = 3  # Read timeout for responses that need the saber to do real work (flash writes, file listing)
+
+    _HANDSHAKE_TIMEOUT = 0.5  # Read timeout for the WR? check; the saber answers in a few ms when it is ready
+    _PING_TIMEOUT = 0.1  # Read timeout for the quick WR? probe of the last known port; anything slower isn't worth it
+
+    _READY_CACHE_TTL = 0.2  # Number of seconds a successful saber_is_ready() check is trusted
+
+    _LEAVES_COMMAND_MODE = (b"WR=", b"ERASE=")  # Commands after which the saber must be checked for readiness again
+
+    _PROBE_CACHE_TTL = 5  # Number of seconds a port list or port_is_anima() result is trusted before checking again
+
     def __init__(
         self, port: str = None, gui: bool = False, loglevel: int = logging.ERROR
     ) -> None:
@@ -119,6 +215,10 @@ class Saber_Controller:
         self.log.info("Initializing saber connection.")
         self.gui = gui  # Flag for whether to output signals for PySide GUI
         self.port = port
+        self._rx_buffer = bytearray()  # Bytes read from the saber but not yet consumed
+        self._ready_until = 0.0  # time.monotonic() until which the last successful saber_is_ready() is trusted
+        self._saber_info = None  # get_saber_info() result; firmware version and serial don't change while connected
+        self._total_space = None  # get_total_space() result; storage size doesn't change while connected either
 
     @staticmethod
     async def create(
@@ -134,21 +234,186 @@ class Saber_Controller:
         # If a specific port is supplied, check that it is an OpenCore saber
         if self.port:
             if not await Saber_Controller.port_is_anima(self.port):
-                self.log.error(f"No OpenCore saber found on port {self.port}")
+                self.log.error("No OpenCore saber found on port %s", self.port)
                 raise NoAnimaSaberException
-        # Otherwise, use the first port found with an OpenCore saber connected
+        # Otherwise, try the port used last time before searching all of them
+        elif await self._reconnect_last_port():
+            return
+        # Then use the first port found with an OpenCore saber connected, preferring the saber used last time
         else:
             ports = await Saber_Controller.get_anima_ports()
-            if ports:
-                self.port = ports[0]
-            else:  # No Anima was found
+            if not ports:  # No Anima was found
                 raise NoAnimaSaberException
+            last_serial = self._read_last_port().get("serial_number")
+            self.port = next(
+                (
+                    port for port in ports
+                    if last_serial and _port_usb_ids.get(port, {}).get("serial_number") == last_serial
+                ),
+                ports[0],
+            )
 
         # Initialize the serial connection
+        try:
+            self._open_port()
+        except Exception:
+            # The saber may have been unplugged or moved since the port was cached, so look again next time
+            Saber_Controller.invalidate_port_cache()
+            raise
+        self._save_last_port(self.port)
+
+    async def _reconnect_last_port(self) -> bool:
+        """Tries the port saved by _save_last_port() before searching all of the system's ports: if the device on it
+        still has the saved USB IDs, opens it and sends a single WR?, waiting at most _PING_TIMEOUT for the answer.
+        Returns False, with the port closed, if it's a different device or no saber answers. Failures are only logged
+        at debug level, since the full search follows.
+
+        The IDs are checked before opening the port, because opening it toggles DTR, which resets some boards."""
+        saved = self._read_last_port()
+        last_port = saved.get("port")
+        if not last_port:
+            return False
+        usb_ids = await asyncio.to_thread(Saber_Controller._get_usb_ids, last_port)
+        if usb_ids is None or any(usb_ids[key] != saved.get(key) for key in usb_ids):
+            self.log.debug("Last known saber port %s now has a different device: %s", last_port, usb_ids)
+            return False
+        self.port = last_port
+        try:
+            self._open_port()
+        except Exception as e:
+            self.log.debug("Unable to open last known saber port %s: %s", last_port, e)
+            self.port = None
+            return False
+        try:
+            await self._transact(_CMD_WRITE_READY, b"OK, Write Ready\n", self._PING_TIMEOUT)
+        except Exception as e:
+            self.log.debug("No saber answering on last known port %s: %s", last_port, e)
+            self.close()
+            self._rx_buffer.clear()  # whatever the device there sent back isn't for us
+            self.port = None
+            return False
+        self.log.debug("Using last known saber port %s", last_port)
+        self._ready_until = time.monotonic() + self._READY_CACHE_TTL
+        _port_usb_ids[last_port] = usb_ids
+        return True
+
+    @staticmethod
+    def _get_usb_ids(port: str) -> dict | None:
+        """Returns the USB IDs ("vid", "pid" and "serial_number") of the device on port, or None if there is none.
+
+        On Linux these are read straight from sysfs for just this port; elsewhere all ports have to be enumerated."""
+        if _SYSTEM == "Linux":
+            from serial.tools.list_ports_linux import SysFS
+
+            info = SysFS(os.path.realpath(port))  # sysfs knows the device by its real name, not a symlink's
+            if info.usb_device_path is None:
+                return None
+        else:
+            import serial.tools.list_ports as lp
+
+            info = next((p for p in lp.comports() if p.device == port), None)
+            if info is None:
+                return None
+        return {"vid": info.vid, "pid": info.pid, "serial_number": info.serial_number}
+
+    @staticmethod
+    def _read_last_port() -> dict:
+        """Returns what _save_last_port() saved (keys "port", "vid", "pid" and "serial_number"), or an empty dict if
+        nothing was."""
+        try:
+            with open(_LAST_PORT_FILE) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return saved if isinstance(saved, dict) else {}
+
+    def _save_last_port(self, port: str) -> None:
+        """Remembers port, and the USB IDs of the saber on it, so the next connection can try it before searching all
+        ports."""
+        saved = {"port": port, **_port_usb_ids.get(port, {})}
+        if saved == self._read_last_port():
+            return
+        try:
+            os.makedirs(os.path.dirname(_LAST_PORT_FILE), exist_ok=True)
+            with open(_LAST_PORT_FILE, "w") as f:
+                json.dump(saved, f)
+        except OSError as e:
+            self.log.debug("Unable to save last port to %s: %s", _LAST_PORT_FILE, e)
+
+    async def __aenter__(self) -> "Saber_Controller":
+        """Allows `async with await Saber_Controller.create() as sc:` so the port is closed however the block exits."""
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def _open_port(self) -> None:
+        """Open and configure the serial connection to self.port. This is the only place the port gets opened."""
+        import aioserial
+
         self._ser = aioserial.AioSerial(self.port)
+        self._saber_info = None  # might be a different saber now
+        self._total_space = None
+        try:
+            self._configure_port()
+        except Exception:
+            self.close()
+            raise
+
+    def _configure_port(self) -> None:
+        """Apply the protocol settings and OS-specific tuning to a newly opened serial port."""
         self._ser.apply_settings(self._SERIAL_SETTINGS)
+        if _SYSTEM == "Windows":
+            # The default 4 KiB driver buffers make multi-MB uploads stall on every few writes
+            try:
+                self._ser.set_buffer_size(rx_size=self._WINDOWS_BUFFER_SIZE, tx_size=self._WINDOWS_BUFFER_SIZE)
+            except Exception as e:
+                self.log.debug("Unable to set serial buffer size on %s: %s", self.port, e)
+        self._set_low_latency()
+
+    def _set_low_latency(self) -> None:
+        """Ask the OS to pass received bytes on immediately instead of batching them (Linux and macOS).
+
+        USB-serial drivers can hold incoming data for up to 16ms before handing it over, which is added to every
+        command/response round trip. Not every adapter supports this, so failures are logged and ignored."""
+        if _SYSTEM == "Darwin":
+            self._set_data_latency_macos()
+            return
+        if _SYSTEM != "Linux":
+            return
+        try:
+            self._ser.set_low_latency_mode(True)
+            self.log.debug("Enabled low latency mode on serial port.")
+            return
+        except Exception as e:
+            self.log.debug("Unable to set ASYNC_LOW_LATENCY on %s: %s", self.port, e)
+        # Fall back to the latency timer exposed by the usb-serial driver (FTDI and friends)
+        try:
+            tty = os.path.basename(os.path.realpath(self.port))
+            with open(f"/sys/bus/usb-serial/devices/{tty}/latency_timer", "w") as latency_timer:
+                latency_timer.write("1")
+            self.log.debug("Set usb-serial latency timer to 1ms.")
+        except OSError as e:
+            self.log.debug("Unable to set latency timer for %s: %s", self.port, e)
+
+    def _set_data_latency_macos(self) -> None:
+        """macOS equivalent of ASYNC_LOW_LATENCY: set the driver's receive latency to 1us with IOSSDATALAT."""
+        import fcntl
+        import struct
+
+        # IOSSDATALAT is _IOW('T', 0, unsigned long) in IOKit/serial/ioss.h
+        IOSSDATALAT = 0x80000000 | (struct.calcsize("L") << 16) | (ord("T") << 8)
+        try:
+            fcntl.ioctl(self._ser.fileno(), IOSSDATALAT, struct.pack("L", 1))
+            self.log.debug("Set serial data latency to 1us.")
+        except Exception as e:
+            self.log.debug("Unable to set IOSSDATALAT on %s: %s", self.port, e)
 
     def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        """Close the serial connection to the saber. Safe to call more than once."""
         # Exception handling is necessary for the case that no saber was found during initialization.
         # In this case, self._ser never gets created.
         try:
@@ -156,53 +421,74 @@ class Saber_Controller:
         except Exception:
             pass
 
+    @staticmethod
+    def invalidate_port_cache() -> None:
+        """Forget cached port lists and port_is_anima() results, e.g. when a device has been plugged in or removed."""
+        _port_list_cache.clear()
+        _anima_cache.clear()
+
+    @staticmethod
+    def _cached_ports(key: str) -> list[str] | None:
+        """Returns the port list cached under key if it is less than _PROBE_CACHE_TTL seconds old, otherwise None."""
+        cached = _port_list_cache.get(key)
+        if cached and time.monotonic() - cached[0] < Saber_Controller._PROBE_CACHE_TTL:
+            return list(cached[1])
+        return None
+
     @staticmethod
     async def get_ports() -> list[str]:
         """DEPRECATED: Use get_anima_ports() instead.
         Returns available serial ports as list of strings."""
-        serial_ports = []
-        match_string = r""
-
+        if (cached := Saber_Controller._cached_ports("get_ports")) is not None:
+            return cached
         _log = logging.getLogger("Saber_Controller")
 
         _log.info("Searching for available serial ports.")
-        port_list = lp.comports()
-        _log.debug(
-            f"Found {len(port_list)} ports before filtering: {[port.device for port in port_list]}"
-        )
+        import serial.tools.list_ports as lp
+
+        port_list = await asyncio.to_thread(lp.comports)
+        if _log.isEnabledFor(logging.DEBUG):  # don't build the device list just to throw it away
+            _log.debug("Found %s ports before filtering: %s", len(port_list), [port.device for port in port_list])
 
         # Filter down list of ports depending on OS
-        system = platform.system()
-        _log.info(f"Detected OS: {system}")
-        if system == "Darwin":
-            match_string = r"^/dev/cu.usb*"
-        elif system == "Windows":
-            match_string = r"^COM\d+"
-        elif system == "Linux":
-            match_string = r"^/dev/ttyS*"
-        else:  # You're on your own!
-            match_string = r"*"
-
-        for port in port_list:
-            if re.match(match_string, port.device):
-                serial_ports.append(port.device)
-
-        _log.info(f"Found {len(serial_ports)} port(s).")
-        _log.debug(f"Found ports: {serial_ports}")
-        return serial_ports
+        _log.info("Detected OS: %s", _SYSTEM)
+        pattern = _PORT_PATTERNS.get(_SYSTEM)  # None means you're on your own!
+        serial_ports = [
+            port.device
+            for port in port_list
+            if pattern is None or pattern.match(port.device)
+        ]
+
+        _log.info("Found %s port(s).", len(serial_ports))
+        _log.debug("Found ports: %s", serial_ports)
+        _port_list_cache["get_ports"] = (time.monotonic(), serial_ports)
+        return list(serial_ports)
 
     @staticmethod
     async def get_anima_ports() -> list[str]:
         """Returns a list of found ports with an Anima connected.
-        If no Anima is found, it will return an empty list."""
+        If no Anima is found, it will return an empty list.
+        A non-empty result is cached for _PROBE_CACHE_TTL seconds."""
+        if cached := Saber_Controller._cached_ports("get_anima_ports"):
+            return cached
+        import serial.tools.list_ports as lp
+
         anima_ports = []
         # Search by VID and PID.
         # EVO: VID=16C0 PID=0483
         # NXT: VID=0483 PID=5740
-        ports = lp.grep(r"VID:PID=(16C0|0483):(0483|5740)")
+        # Enumerating ports can take 100s of ms on Windows, so keep it off the event loop
+        ports = await asyncio.to_thread(
+            lambda: list(lp.grep(r"VID:PID=(16C0|0483):(0483|5740)"))
+        )
+        now = time.monotonic()
         for port in ports:
             anima_ports.append(port.device)
-        return anima_ports
+            _anima_cache[port.device] = (now, True)
+            _port_usb_ids[port.device] = {"vid": port.vid, "pid": port.pid, "serial_number": port.serial_number}
+        if anima_ports:  # don't cache an empty result, so a newly plugged in saber is found straight away
+            _port_list_cache["get_anima_ports"] = (now, anima_ports)
+        return list(anima_ports)
 
     @staticmethod
     async def port_is_anima(port: str) -> bool:
@@ -210,12 +496,17 @@ class Saber_Controller:
         Returns True if an Anima is found, False otherwise.
 
         NB: This method will not throw exceptions. Any exceptions will cause result of False.
+        A positive result is cached for _PROBE_CACHE_TTL seconds, so repeated checks of the same port are free.
         """
+        cached = _anima_cache.get(port)
+        if cached and time.monotonic() - cached[0] < Saber_Controller._PROBE_CACHE_TTL:
+            return cached[1]
 
+        is_anima = False
         try:
             log = logging.getLogger("Saber_Controller")
 
-            log.debug(f"Checking if decvice on port {port} is a Polaris Anima EVO.")
+            log.debug("Checking if decvice on port %s is a Polaris Anima EVO.", port)
             # Old Checking Logic
             # ------------------
             # ser = serial.Serial(port)
@@ -259,56 +550,146 @@ class Saber_Controller:
 
             # New Checking Logic - check VID and PID of device
             # ------------------------------------------------
-            ports = lp.grep(port)
-            p = next(ports)  # Will raise a StopIteration exception if no port found
+            import serial.tools.list_ports as lp
+
+            ports = await asyncio.to_thread(lambda: list(lp.grep(port)))
+            p = ports[0]  # Will raise an IndexError exception if no port found
             if (p.vid == 0x16C0 and p.pid == 0x0483) or (
                 p.vid == 0x483 and p.pid == 0x5740
             ):
-                return True
-            return False
+                is_anima = True
+                _port_usb_ids[port] = {"vid": p.vid, "pid": p.pid, "serial_number": p.serial_number}
         except Exception:
-            log.debug(f"No Polaris Anima EVO found on port {port}")
-            return False
+            log.debug("No Polaris Anima EVO found on port %s", port)
+
+        if is_anima:  # don't cache a miss, so a saber plugged in just now is found on the next try
+            _anima_cache[port] = (time.monotonic(), True)
+        return is_anima
 
     async def send_command(self, cmd: bytes) -> None:
-        """Send command string to attached saber. It will automatically add b'\n' terminator if not already present.
+        """Send command string to attached saber. cmd must already end with the b'\n' terminator; it is sent as-is.
 
         Note: this method does not check that the saber is write-ready."""
-        if not cmd.endswith(b"\n"):
-            cmd += b"\n"
+        assert cmd.endswith(b"\n"), f"Command is missing its newline terminator: {cmd}"
+        if cmd.startswith(self._LEAVES_COMMAND_MODE):  # saber will be busy, so check again before the next command
+            self._ready_until = 0.0
         if len(cmd) <= self._CHUNK_SIZE:  # Send the whole thing at once
-            self.log.debug(f"Sending command to saber: {cmd}")
+            self.log.debug("Sending command to saber: %s", cmd)
             await self._ser.write_async(cmd)
         else:  # send in chunks
-            self.log.debug(f"Sending command in chunks of {self._CHUNK_SIZE} bytes")
-            pos = 0
-            while pos < len(cmd):
-                self.log.debug(
-                    f"Sending command to saber: {cmd[pos:pos+self._CHUNK_SIZE]}"
-                )
+            self.log.debug("Sending command to saber in chunks of %s bytes: %s", self._CHUNK_SIZE, cmd)
+            for pos in range(0, len(cmd), self._CHUNK_SIZE):
                 await self._ser.write_async(cmd[pos:pos + self._CHUNK_SIZE])
-                pos += self._CHUNK_SIZE
-                await asyncio.sleep(0.5)
+                # Let the block drain, then give the saber the same breather as an NXT file upload
+                await asyncio.to_thread(self._ser.flush)
+                await asyncio.sleep(self._CHUNK_DELAY)
 
-    async def read_line(self) -> bytes:
+    async def read_line(self, timeout: float = None) -> bytes:
         """Reads the next line (terminated by b'\n') from the serial buffer.
+        If timeout is given, it is the most this call will wait for the whole line (see _read_until()).
 
         Note: this removes the line from the buffer."""
-        response = await self._ser.readline_async()
-        self.log.debug(f"Received response: {response}")
+        response = await self._read_until(b"\n", timeout)
+        self.log.debug("Received response: %s", response)
+        return response
+
+    async def _read_available(self) -> bytes:
+        """Returns everything that has been received but not yet consumed, waiting (up to the serial timeout) for at
+        least one byte if nothing is pending. Returns b"" on timeout.
+
+        Draining in blocks like this avoids a separate read call for every byte."""
+        if self._rx_buffer:
+            data = bytes(self._rx_buffer)
+            self._rx_buffer.clear()
+            return data
+        return await self._ser.read_async(max(1, self._ser.in_waiting))
+
+    async def _read_until(self, terminator: bytes, timeout: float = None) -> bytes:
+        """Reads up to and including terminator, draining the serial buffer in blocks rather than byte by byte
+        (pyserial's own readline()/read_until() make a read call per byte). Anything received after the terminator is
+        kept for the next read.
+
+        If timeout is given, it is a deadline for the whole call, so a saber trickling out bytes can't keep it waiting
+        indefinitely; otherwise it gives up once no data arrives within the serial read timeout. Either way, on timeout
+        returns whatever was received, which won't end with terminator."""
+        end = self._rx_buffer.find(terminator)
+        if end >= 0:  # already buffered
+            end += len(terminator)
+            response = bytes(self._rx_buffer[:end])
+            del self._rx_buffer[:end]
+            return response
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        received = bytearray()
+        while (end := received.find(terminator)) < 0:
+            if deadline is None:
+                chunk = await self._read_available()
+            elif (remaining := deadline - time.monotonic()) > 0:
+                with self._temporary_timeout(remaining):  # returns as soon as data arrives, or when time is up
+                    chunk = await self._read_available()
+            else:
+                chunk = b""
+            if not chunk:  # timed out
+                return bytes(received)
+            received += chunk
+        end += len(terminator)
+        self._unread(received[end:])
+        return bytes(received[:end])
+
+    async def read_until_idle(self, timeout: float = None) -> bytes:
+        """Returns everything the saber sends until it goes quiet for timeout seconds (default: the serial timeout).
+
+        For responses with no known terminator, such as the reply to an arbitrary command. The whole response is
+        collected in blocks and returned at once, rather than being read a line at a time."""
+        if timeout is not None:
+            with self._temporary_timeout(timeout):
+                return await self.read_until_idle()
+
+        received = bytearray()
+        while chunk := await self._read_available():
+            received += chunk
+        return bytes(received)
+
+    @contextlib.contextmanager
+    def _temporary_timeout(self, timeout: float):
+        """Context manager that changes the serial read timeout, restoring the previous value on exit."""
+        previous = self._ser.timeout
+        self._ser.timeout = timeout
+        try:
+            yield
+        finally:
+            self._ser.timeout = previous
+
+    def _unread(self, data: bytes) -> None:
+        """Puts data back at the front of the receive buffer, to be returned by the next read."""
+        self._rx_buffer[:0] = data
+
+    async def _transact(self, cmd: bytes, expect: bytes = None, timeout: float = None) -> bytes:
+        """Sends cmd and returns the saber's one-line response.
+
+        If expect is given, raises InvalidSaberResponseException unless the response starts with it."""
+        await self.send_command(cmd)
+        response = await self.read_line(timeout)
+        if expect is not None and not response.startswith(expect):
+            self._ready_until = 0.0  # something is off, so don't trust the last readiness check
+            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
         return response
 
     async def saber_is_ready(self) -> bool:
         """Checks to see if saber is ready to receive commands.
 
         NB: This method will not throw exceptions. Any exceptions will cause result of False.
+        A successful check is trusted for _READY_CACHE_TTL seconds, unless a command that keeps the saber busy (upload,
+        erase) is sent in the meantime.
         """
+        if time.monotonic() < self._ready_until:
+            return True
         try:
-            await self.send_command(b"WR?")
-            response = await self.read_line()
-            self.log.debug(f"Response = {response}")
+            response = await self._transact(_CMD_WRITE_READY, timeout=self._HANDSHAKE_TIMEOUT)
+            self.log.debug("Response = %s", response)
             if response == b"OK, Write Ready\n":
                 self.log.debug("Saber is ready to receive commands.")
+                self._ready_until = time.monotonic() + self._READY_CACHE_TTL
                 return True
             self.log.error("Saber is not ready to receive commands.")
             return False
@@ -316,147 +697,181 @@ class Saber_Controller:
             self.log.error("Saber is not ready to receive commands.")
             return False
 
-    async def get_saber_info(self) -> dict:
-        """Retrieve firmware version and serial number from saber. Returns a dict with keys 'version' and 'serial'."""
-        if await self.saber_is_ready():
-            self.log.info("Retrieving firmware version and serial number from saber.")
+    async def _send_query_when_ready(self, cmd: bytes) -> bool:
+        """Sends cmd, a query, after making sure the saber is ready to receive commands. Returns False if it isn't.
+
+        Unless a recent saber_is_ready() check can be trusted, the WR? check goes out in the same write as cmd, saving
+        a round trip. Only use this for commands that don't change anything, since the saber gets cmd even if it turns
+        out not to be ready. In that case any reply to cmd is read and discarded, so it can't be taken for the answer
+        to a later command."""
+        if time.monotonic() < self._ready_until:
+            await self.send_command(cmd)
+            return True
+        await self.send_command(_CMD_WRITE_READY + cmd)
+        response = await self.read_line(self._HANDSHAKE_TIMEOUT)
+        self.log.debug("Response = %s", response)
+        if response == b"OK, Write Ready\n":
+            self.log.debug("Saber is ready to receive commands.")
+            self._ready_until = time.monotonic() + self._READY_CACHE_TTL
+            return True
+        self.log.error("Saber is not ready to receive commands.")
+        # cmd has already been sent, and its reply may still be on the way: wait for the saber to go quiet, dropping
+        # everything received until then (reset_input_buffer() would only drop what has already arrived)
+        discarded = await self.read_until_idle(self._HANDSHAKE_TIMEOUT)
+        self.log.debug("Discarded: %s", discarded)
+        return False
+
+    async def get_saber_info(self, refresh: bool = False) -> dict:
+        """Retrieve firmware version and serial number from saber. Returns a dict with keys 'version' and 'serial'.
+
+        The saber is only asked once per connection; later calls return the same values unless refresh is True."""
+        if self._saber_info is not None and not refresh:
+            return dict(self._saber_info)  # a copy, so callers can't change the cached values
+        self.log.info("Retrieving firmware version and serial number from saber.")
+        # Send both queries in one write (along with the readiness check); the saber answers them in order.
+        if await self._send_query_when_ready(_CMD_VERSION + _CMD_SERIAL):
             info = {}
 
             # get firmware version
-            cmd = b"V?"
-            await self.send_command(cmd)
+            cmd = _CMD_VERSION
             response = await self.read_line()
             if not response or not response.startswith(b"V="):
                 raise InvalidSaberResponseException(
                     f"Command: {cmd}\nResponse: {response}"
                 )
             else:
-                info["version"] = response.decode().strip()[2:]
+                info["version"] = response.strip().removeprefix(b"V=").decode()
 
             # get serial number
-            cmd = b"S?"
-            await self.send_command(cmd)
+            cmd = _CMD_SERIAL
             response = await self.read_line()
             if not response or not response.startswith(b"S="):
                 raise InvalidSaberResponseException(
                     f"Command: {cmd}\nResponse: {response}"
                 )
             else:
-                info["serial"] = response.decode().strip()[2:]
+                info["serial"] = response.strip().removeprefix(b"S=").decode()
 
-            self.log.info(f"Found saber info: {info}")
-            return info
+            self.log.info("Found saber info: %s", info)
+            self._saber_info = info
+            return dict(info)
         else:
             raise AnimaNotReadyException
 
     async def list_files_on_saber_as_bytes(self) -> bytes:
         """Returns the raw byte string reported by the saber LIST? command."""
-        file_list = b""
         self.log.info("Retrieving file list from saber.")
 
-        if await self.saber_is_ready():
-            cmd = b"LIST?"
-            await self.send_command(cmd)
-            response = b""
-
-            while not response.endswith(b"\x03\n"):
-                response = await self.read_line()
-                file_list += response
+        if await self._send_query_when_ready(_CMD_LIST):
+            file_list = await self._read_until(b"\x03\n", self._LONG_TIMEOUT)  # list ends with an end-of-text marker
+            if not file_list.endswith(b"\x03\n"):
+                raise InvalidSaberResponseException(f"Incomplete file list received: {file_list}")
 
-            self.log.debug(f"Final byte string: {file_list}")
+            self.log.debug("Final byte string: %s", file_list)
             return file_list
         else:
             raise AnimaNotReadyException
 
+    async def iter_files_on_saber(self):
+        """Yields the lines of the saber's LIST? report, decoded and without the start/end-of-text markers, as they
+        arrive. Unlike list_files_on_saber_as_bytes(), callers can show the first files before the whole list has been
+        received. The generator should be run to completion, so the rest of the list isn't left unread."""
+        self.log.info("Retrieving file list from saber.")
+
+        if not await self._send_query_when_ready(_CMD_LIST):
+            raise AnimaNotReadyException
+        while True:
+            line = await self.read_line(self._LONG_TIMEOUT)
+            if not line.endswith(b"\n"):
+                raise InvalidSaberResponseException(f"Incomplete file list received: {line}")
+            line = line.rstrip(b"\r\n")
+            last = line.endswith(b"\x03")  # end-of-text marker, which may follow the last entry on the same line
+            if entry := line.strip(b"\x02\x03"):  # skip the start/end-of-text markers
+                yield entry.decode()
+            if last:
+                return
+
     async def list_files_on_saber(self) -> dict[str:int]:
         """Returns a dictionary containing the files on the saber.
         Key is the filename, value is the file size in bytes."""
-        file_dict = {}
-        file_list = (await self.list_files_on_saber_as_bytes()).decode()
-        regex = re.compile(r"^(\w+\.RAW)\s+(\d+)$", re.MULTILINE)
-        matches = regex.findall(file_list)
-        for match in matches:
-            file_dict[match[0]] = int(match[1])
-        return file_dict
+        # Match against the raw bytes, so only the file names need decoding
+        file_list = await self.list_files_on_saber_as_bytes()
+        return {name.decode(): int(size) for name, size in _FILE_LIST_RE.findall(file_list)}
 
     async def erase_all_files(self, progress_callback: callable = None) -> None:
         """Erases all files on the anima. USE CAREFULLY."""
         if await self.saber_is_ready():
             self.log.info("Erasing all files on saber. This may take several minutes.")
-            cmd = b"ERASE=ALL"
+            cmd = _CMD_ERASE_ALL
             await self.send_command(cmd)
 
             # Listen to output stream to make sure process is ongoing/completed
-            response = (
-                await self.read_line()
-            )  # "Erasing Serial Flash, this may take 20s to 2 minutes\n"
-            self._ser.timeout = 5  # increase timeout while we wait for #s to display
-            i = 0
-            c = await self._ser.read_async(1)
-            while c < b"\x41":  # any ascii character before 'A'
+            await self.read_line(self._LONG_TIMEOUT)  # "Erasing Serial Flash, this may take 20s to 2 minutes\n"
+            with self._temporary_timeout(5):  # increase timeout while we wait for #s to display
+                i = 0
+                done = False
+                while not done:
+                    # Progress is any ascii character before 'A'. Read whatever has arrived and stop at the first byte
+                    # that isn't progress, putting the rest back so read_line() picks up the completion message.
+                    chunk = await self._read_available()
+                    n = next((n for n, c in enumerate(chunk) if c >= 0x41), None)
+                    if n is not None:
+                        self._unread(chunk[n:])
+                        chunk = chunk[:n]
+                        done = True
+                    if chunk:  # report the whole block at once
+                        if self.gui:
+                            i += len(chunk)
+                            progress_callback(i * 100 // 140)
+                        print(chunk.decode("ascii", "replace"), end="", flush=True)
+                await self.read_line()  # b'OK, Now re-load your sound files.\n'
+                await self.read_line()  # b'OK, Serial Flash Erased.\n'
+                await self.read_line()  # b'\n'
                 if self.gui:
-                    i += 1
-                    progress_callback(i * 100 // 140)
-                print(c.decode(), end="", flush=True)
-                c = await self._ser.read_async(1)
-            # manually read the next line using the serial connection and combine it with the last char read.
-            response = c + await self._ser.readline_async()
-            self.log.debug(
-                f"Received response: {response}"
-            )  # b'OK, Now re-load your sound files.\n'
-            response = await self.read_line()  # b'OK, Serial Flash Erased.\n'
-            response = await self.read_line()  # b'\n'
-            if self.gui:
-                progress_callback(100)
-            self._ser.timeout = self._SERIAL_SETTINGS["timeout"]
+                    progress_callback(100)
         else:
             raise AnimaNotReadyException
 
     async def get_free_space(self) -> int:
         """Returns the amount of free space in Anima storage in bytes."""
         self.log.info("Getting free space on Anima.")
-        cmd = b"FREE?"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        r = response.decode().strip()
-        free_space = int(r[5:])
-        self.log.info(f"Free space: {free_space} bytes")
+        response = await self._transact(_CMD_FREE, b"FREE=")
+        free_space = int(response.removeprefix(b"FREE="))  # int() takes bytes and ignores the trailing newline
+        self.log.info("Free space: %s bytes", free_space)
         return free_space
 
     async def get_used_space(self) -> int:
         """Returns the amount of used space in Anima storage in bytes."""
         self.log.info("Getting used space on Anima.")
-        cmd = b"USED?"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        r = response.decode().strip()
-        used_space = int(r[5:])
-        self.log.info(f"Used space: {used_space} bytes")
+        response = await self._transact(_CMD_USED, b"USED=")
+        used_space = int(response.removeprefix(b"USED="))
+        self.log.info("Used space: %s bytes", used_space)
         return used_space
 
-    async def get_total_space(self) -> int:
-        """Returns the amount of total storage space in Anima storage in bytes."""
+    async def get_total_space(self, refresh: bool = False) -> int:
+        """Returns the amount of total storage space in Anima storage in bytes.
+
+        The saber is only asked once per connection, unless refresh is True."""
+        if self._total_space is not None and not refresh:
+            return self._total_space
         self.log.info("Getting total storage space on Anima.")
-        cmd = b"SIZE?"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        r = response.decode().strip()
-        total_space = int(r[5:])
-        self.log.info(f"Total space: {total_space} bytes")
-        return total_space
+        response = await self._transact(_CMD_SIZE, b"SIZE=")
+        self._total_space = int(response.removeprefix(b"SIZE="))
+        self.log.info("Total space: %s bytes", self._total_space)
+        return self._total_space
 
     async def read_config_ini(self) -> str:
         """Read the config.ini file from saber and return as a string"""
         self.log.info("Reading config.ini from saber")
-        cmd = b"RD?config.ini\n"
+        cmd = _CMD_READ_CONFIG
         await self.send_command(cmd)
         # Anima doesn't seem to properly send STX/ETX bytes. Instead just sends '2' and '3'
-        config = b""
-        while not config.endswith(b"}3"):
-            # read one byte at a time, since last line isn't terminated with \n
-            config += await self._ser.read_async()
+        # Last line isn't terminated with \n, so read up to the closing brace and '3' instead of by line
+        config = await self._read_until(b"}3", self._LONG_TIMEOUT)
+        if not config.endswith(b"}3"):
+            raise InvalidSaberResponseException(f"Incomplete config.ini received: {config}")
 
-        self.log.debug(f"Raw config string: {config}")
+        self.log.debug("Raw config string: %s", config)
         # slice off first and last char ('2' and '3')
         return config.decode().strip()[1:-1]
 
@@ -475,28 +890,33 @@ class Saber_Controller:
         files: list[str],
         progress_callback: callable = None,
         add_beep: bool = True,
+        sizes: dict[str, int] = None,
     ) -> None:
         """Write file(s) to saber. Expects a list of file names.
 
         If add_beep is True (default), this method will automatically add the defauly BEEP.RAW for NXT sabers if no
         other BEEP.RAW is supplied or already on saber.
 
+        sizes may map file names to their sizes in bytes, if the caller has already stat'ed them. Any file not in it is
+        stat'ed here.
+
         NB: This method does no checking that files exist either on disk or saber. Please verify files before calling
         this method.
         """
         files.sort()
 
         SLEEP_TIME = 0.0
+        chunk_size = self._UPLOAD_CHUNK_SIZE
         if await self.anima_is_NXT():
             # --- Manage BEEP file ---
-            beep_files = [file for file in files if "BEEP.RAW" in file]
+            beep_files, other_files = [], []
+            for file in files:  # one pass, keeping the sorted order within each group
+                (beep_files if "BEEP.RAW" in file else other_files).append(file)
             # if a BEEP.RAW is specified, move it to the end of the list.
             # NXTs seem to do better if BEEP.RAW is the last file uploaded
             if beep_files:
-                for file in beep_files:
-                    self.log.debug(f"Moving file {file} to end of upload list.")
-                    files.remove(file)
-                    files.append(file)
+                self.log.debug("Moving file(s) %s to end of upload list.", beep_files)
+                files[:] = other_files + beep_files
             elif add_beep:
                 current_files = await self.list_files_on_saber()
                 if "BEEP.RAW" not in current_files.keys():
@@ -510,224 +930,197 @@ class Saber_Controller:
             # Update: seems to happen on Windows, too.
             #if platform.system() != "Windows":
             self.log.info("Anima NXT detected. Manually managing upload speed.")
-            SLEEP_TIME = 0.012 #0.000087
+            SLEEP_TIME = self._CHUNK_DELAY #0.000087
+            chunk_size = self._CHUNK_SIZE
+
+        self.log.info("Preparing to write file(s) to saber: %s", files)
+
+        # Query free space once and check the whole batch against it, rather than asking before every file.
+        # This ignores any per-file allocation overhead on the saber.
+        free_space = await self.get_free_space()
+        # stat each file once, up front, in a worker thread so a slow disk doesn't hold up the event loop
+        known_sizes = sizes or {}
+        file_sizes = await asyncio.to_thread(
+            lambda: [known_sizes[file] if file in known_sizes else os.stat(file).st_size for file in files]
+        )
+        total_size = sum(file_sizes)
+        if free_space < total_size:
+            raise NotEnoughFreeSpaceException(
+                f"Required: {getHumanReadableSize(total_size)} - Available: {getHumanReadableSize(free_space)}"
+            )
 
-        self.log.info(f"Preparing to write file(s) to saber: {files}")
-        for file in files:
-            self.log.info(f"Writing file to saber: {file}")
+        # Each file is read in a worker thread while the previous one is still being sent and acknowledged
+        previous_write_ok = False
+        async with contextlib.aclosing(self._read_files(files)) as contents:
+            for file, file_size in zip(files, file_sizes):
+                self.log.info("Writing file to saber: %s", file)
+                fname = os.path.basename(file)
 
-            # Check for enough free space
-            file_size = os.path.getsize(file)
-            self.log.debug(f"File size: {file_size}")
-            free_space = await self.get_free_space()
-            if free_space < file_size:
-                raise NotEnoughFreeSpaceException(f"File: {file}")
+                self.log.debug("File size: %s", file_size)
 
-            # Write the file
-            with open(file, mode="rb") as binary_file:
-                if await self.saber_is_ready():
+                # Write the file
+                data = await anext(contents)
+                # "OK, Write Complete" for the previous file already says the saber is ready for the next one
+                if previous_write_ok or await self.saber_is_ready():
                     bytes_sent = 0
-                    fname = os.path.basename(file)
-                    report_every_n_bytes = (
-                        self._CHUNK_SIZE * 3
-                    )  # How often to update the bytes sent display
-
-                    cmd = (
-                        b"WR="
-                        + fname.encode("utf-8")
-                        + b", "
-                        + str(file_size).encode("utf-8")
-                        + b"\n"
-                    )
+                    write = self._ser.write_async  # runs in an executor, so a full TX buffer can't stall the loop
+
+                    cmd = b"WR=%b, %d\n" % (fname.encode("utf-8"), file_size)
                     await self.send_command(cmd)
-                    response = await self.read_line()
-                    self.log.debug(f"Beginning byte stream for file {fname}")
+                    response = await self.read_line(self._LONG_TIMEOUT)
+                    self.log.debug("Beginning byte stream for file %s", fname)
                     # Writing in chunks works better with the manual timing code for NXTs (instead of writing one byte
                     # at a time). I think the very small time between bytes when sending a single byte was causing 
-                    # some rounding issues. 
-                    bytes = binary_file.read(self._CHUNK_SIZE)
+                    # some rounding issues.
+                    # EVOs don't need the pacing, so they get larger blocks and no flushing at all: the Write Complete
+                    # ack read below can't arrive until the saber has received everything anyway.
                     print(
                         f"{fname} - Data sent: {getHumanReadableSize(bytes_sent)} - Data remaining: {getHumanReadableSize(file_size - bytes_sent)} - Speed: 0.00B/s",  # noqa: E501
                         end="",
                         flush=True,
                     )
                     await asyncio.sleep(SLEEP_TIME)
-                    start_time = time.time()
-                    while bytes:
-                        self._ser.write(bytes)
-                        self._ser.flush()
-                        await asyncio.sleep(SLEEP_TIME)  # will be 0.0 if EVO
-                        bytes_sent += len(bytes)
-                        bytes = binary_file.read(self._CHUNK_SIZE)
-                        if bytes_sent % report_every_n_bytes == 0:
-                            print(
-                                f"\r{fname} - Data sent: {getHumanReadableSize(bytes_sent)} - Data remaining: {getHumanReadableSize(file_size - bytes_sent)} - Speed: {getHumanReadableSize(bytes_sent/(time.time()-start_time))}/s   ",  # noqa: E501
-                                end="",
-                                flush=True,
+                    start_time = time.monotonic()
+                    next_report = start_time + self._PROGRESS_INTERVAL
+                    write_stdout, flush_stdout = sys.stdout.write, sys.stdout.flush
+                    for offset in range(0, file_size, chunk_size):
+                        chunk = data[offset:offset + chunk_size]
+                        await write(chunk)
+                        if SLEEP_TIME:
+                            await asyncio.to_thread(self._ser.flush)  # tcdrain blocks too, so keep it off the loop
+                            # Pace by bytes rather than chunks, so a short final chunk doesn't wait a full interval
+                            await asyncio.sleep(SLEEP_TIME * len(chunk) / chunk_size)
+                        bytes_sent += len(chunk)
+                        now = time.monotonic()
+                        if now >= next_report:  # Throttle display updates so they don't slow the upload
+                            next_report = now + self._PROGRESS_INTERVAL
+                            write_stdout(
+                                f"\r{fname} - Data sent: {getHumanReadableSize(bytes_sent)} - Data remaining: {getHumanReadableSize(file_size - bytes_sent)} - Speed: {getHumanReadableSize(bytes_sent/(now-start_time))}/s   "  # noqa: E501
                             )
+                            flush_stdout()
                             if self.gui:
                                 progress_callback(bytes_sent)
+                    elapsed = max(time.monotonic() - start_time, 1e-6)  # monotonic() can be coarse on Windows
                     print(
-                        f"\r{fname} - Data sent: {getHumanReadableSize(bytes_sent)} - Data remaining: {getHumanReadableSize(file_size - bytes_sent)} - Speed: {getHumanReadableSize(bytes_sent/(time.time()-start_time))}/s           "  # noqa: E501
+                        f"\r{fname} - Data sent: {getHumanReadableSize(bytes_sent)} - Data remaining: {getHumanReadableSize(file_size - bytes_sent)} - Speed: {getHumanReadableSize(bytes_sent/elapsed)}/s           "  # noqa: E501
                     )
                     if self.gui:
                         progress_callback(bytes_sent)
                 else:
                     raise AnimaNotReadyException
 
-            response = await self.read_line()
-            if not response == b"OK, Write Complete\n":
-                raise AnimaFileWriteException(
-                    f"Error message: {response.strip().decode()}"
+                response = await self.read_line(self._LONG_TIMEOUT)
+                if not response == b"OK, Write Complete\n":
+                    raise AnimaFileWriteException(
+                        f"Error message: {response.strip().decode()}"
+                    )
+
+                self.log.info("Successfully wrote file to saber: %s", file)
+                previous_write_ok = True
+                self.log.info("Pausing %s seconds between file uploads.", self.FILE_DELAY)
+                print(
+                    f"Pausing {self.FILE_DELAY} seconds between file uploads",
+                    end="",
+                    flush=True,
                 )
+                i = self.FILE_DELAY
+                while i > 0:
+                    if i < 1:
+                        await asyncio.sleep(i)
+                        i = 0
+                    else:
+                        await asyncio.sleep(1)
+                        print(" .", end="", flush=True)
+                        i -= 1
+                print("\r", end="", flush=True)
 
-            self.log.info(f"Successfully wrote file to saber: {file}")
-            self.log.info(f"Pausing {self.FILE_DELAY} seconds between file uploads.")
-            print(
-                f"Pausing {self.FILE_DELAY} seconds between file uploads",
-                end="",
-                flush=True,
-            )
-            i = self.FILE_DELAY
-            while i > 0:
-                if i < 1:
-                    await asyncio.sleep(i)
-                    i = 0
-                else:
-                    await asyncio.sleep(1)
-                    print(" .", end="", flush=True)
-                    i -= 1
-            print("\r", end="", flush=True)
+    @staticmethod
+    async def _read_files(files: list[str]):
+        """Yields the contents of each file in turn.
+
+        The next file is read in a worker thread while the caller is still sending the current one, so disk reads
+        overlap with serial writes (and waiting for the saber) instead of alternating with them."""
+
+        def read_file(file: str) -> bytes:
+            with open(file, mode="rb") as binary_file:
+                return binary_file.read()
+
+        if not files:
+            return
+        next_contents = asyncio.ensure_future(asyncio.to_thread(read_file, files[0]))
+        try:
+            for file in files[1:]:
+                contents = await next_contents
+                next_contents = asyncio.ensure_future(asyncio.to_thread(read_file, file))
+                yield contents
+            yield await next_contents
+        finally:
+            next_contents.cancel()
 
     @staticmethod
     def rgbw_to_byte_str(r: int, g: int, b: int, w: int):
-        return (
-            bytes(str(r), "ascii")
-            + b","
-            + bytes(str(g), "ascii")
-            + b","
-            + bytes(str(b), "ascii")
-            + b","
-            + bytes(str(w), "ascii")
-        )
+        return b"%d,%d,%d,%d" % (r, g, b, w)
 
     async def preview_color(self, r: int, g: int, b: int, w: int):
-        cmd = b"P=" + self.rgbw_to_byte_str(r, g, b, w) + b"\n"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        if response[:2] != b"OK":
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
+        cmd = b"P=%d,%d,%d,%d\n" % (r, g, b, w)
+        await self._transact(cmd, b"OK")
 
     async def set_color(self, bank: int, effect: str, r: int, g: int, b: int, w: int):
         """Writes a color setting to the saber.
         bank specifies which bank (0-7).
         effect is one of "color", "clash", or "swing".
         RGBW values are 0-255"""
-        match effect:
-            case "color":
-                cmd = b"C"
-            case "clash":
-                cmd = b"F"
-            case "swing":
-                cmd = b"W"
-            case _:
-                self.log.error(f"Invalid effect type specified: {effect}")
-                return
+        prefix = _COLOR_EFFECT_CMD.get(effect)
+        if prefix is None:
+            self.log.error("Invalid effect type specified: %s", effect)
+            return
 
-        cmd = (
-            cmd
-            + bytes(str(bank), "ascii")
-            + b"="
-            + self.rgbw_to_byte_str(r, g, b, w)
-            + b"\n"
-        )
-        await self.send_command(cmd)
-        response = await self.read_line()
-        if response[:2] != b"OK":
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
+        cmd = b"%b%d=%d,%d,%d,%d\n" % (prefix, bank, r, g, b, w)
+        await self._transact(cmd, b"OK")
         await self.save_config()
 
     async def set_active_bank(self, bank: int):
         """Sets the active bank (0-7)"""
-        cmd = b"B=" + bytes(str(bank), "ascii") + b"\n"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        if response[:2] != b"OK":
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
+        cmd = b"B=%d\n" % bank
+        await self._transact(cmd, b"OK")
         await self.save_config()
 
     @staticmethod
     def _get_cmd_for_sound_effect(effect: str) -> bytes:
         """returns the command header for the given sound effect.
         Calling function needs to either add '?' or '=' to the end."""
-        match effect:
-            case "on":
-                return b"sON"
-            case "off":
-                return b"sOFF"
-            case "hum":
-                return b"sHUM"
-            case "swing":
-                return b"sSW"
-            case "clash":
-                return b"sCL"
-            case "smoothSwingA":
-                return b"sSMA"
-            case "smoothSwingB":
-                return b"sSMB"
-            case _:
-                raise InvalidSoundEffectSpecifiedException(
-                    f"Specified effect: {effect}"
-                )
+        try:
+            return _SOUND_EFFECT_CMD[effect]
+        except KeyError:
+            raise InvalidSoundEffectSpecifiedException(
+                f"Specified effect: {effect}"
+            ) from None
 
     async def set_sounds_for_effect(self, effect: str, files: list[str]):
         """Sets the sound list for a given effect."""
         if not self.gui:
             print(f'Setting sound files for effect "{effect}".')
-        self.log.info(f'Setting sound files for effect "{effect}".')
-        self.log.debug(f"{effect}: {str(files)}.")
-        cmd = (
-            self._get_cmd_for_sound_effect(effect)
-            + b"="
-            + ",".join(files).encode("utf-8")
-        )
-        await self.send_command(cmd)
-        response = await self.read_line()
-        if response != b"OK " + cmd + b"\n":
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
+        self.log.info('Setting sound files for effect "%s".', effect)
+        self.log.debug("%s: %s.", effect, files)
+        cmd = b"%b=%b\n" % (self._get_cmd_for_sound_effect(effect), b",".join(f.encode("utf-8") for f in files))
+        await self._transact(cmd, b"OK " + cmd)  # saber echoes the whole command back
         await self.save_config()
 
     async def get_sounds_for_effect(self, effect: str) -> list[str]:
         """Returns a list of filenames Anima is using for the specified effect."""
-        self.log.debug(f'Retrieving list of sound files for effect "{effect}".')
-        cmd = self._get_cmd_for_sound_effect(effect) + b"?"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        r = response.split(b"=")
-        if r[0] != self._get_cmd_for_sound_effect(effect):
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
-        return r[1].decode().strip().split(",")
+        self.log.debug('Retrieving list of sound files for effect "%s".', effect)
+        header = self._get_cmd_for_sound_effect(effect)
+        prefix = header + b"="  # response is the header, '=', then the file list
+        response = await self._transact(header + b"?\n", prefix)
+        return response[len(prefix):].decode().strip().split(",")
 
     async def save_config(self):
         """Save the current configuration to the saber."""
         self.log.debug("Saving configuration on saber.")
-        cmd = b"SAVE"
-        await self.send_command(cmd)
-        response = await self.read_line()
-        if response != b"OK SAVE\n":
-            raise InvalidSaberResponseException(f"Command: {cmd}\nResponse: {response}")
+        await self._transact(_CMD_SAVE, b"OK SAVE\n", self._LONG_TIMEOUT)
 
     async def auto_assign_sound_effects(self):
         """Attempt to automatically set sound effects based on the files currently on the saber."""
-        effects = {  # dictionary of effects and matching filename patterns
-            "on": "POWERON",
-            "off": "POWEROFF",
-            "hum": "HUM",
-            "swing": "SWING",
-            "clash": "CLASH",
-            "smoothSwingA": "SMOOTHSWINGH",
-            "smoothSwingB": "SMOOTHSWINGL",
-        }
         files = (
             await self.list_files_on_saber()
         ).keys()  # Just the keys because we only need the filenames
@@ -741,16 +1134,22 @@ class Saber_Controller:
         # NXTs have problems if you try to set both regular Swing and SmoothSwing effects at the same time.
         # EVOs don't seem to have this problem, but it's probably good practice not to set it anyway.
         # So we search the file list, and if there are any SmoothSwing files, we remove the regular Swing.
-        if any("SMOOTHSWING" in file for file in files):
+        smoothswing = any("SMOOTHSWING" in file for file in files)
+        if smoothswing:
             self.log.info(
                 "Detected SmoothSwing files. Ignoring any standard Swing files."
             )
-            files = [f for f in files if not f.startswith("SWING")]
 
-        for effect in effects.keys():
-            list = [f for f in files if f.startswith(effects[effect])]
-            await self.set_sounds_for_effect(effect, list)
-            await asyncio.sleep(0.5)
+        # Sort the files into per-effect lists in a single pass over the file list
+        sounds = {effect: [] for effect in _EFFECT_FILE_PREFIXES}
+        for file in files:
+            if smoothswing and file.startswith("SWING"):
+                continue
+            if match := _EFFECT_FILE_RE.match(file):
+                sounds[match.lastgroup].append(file)
+
+        for effect, effect_files in sounds.items():
+            await self.set_sounds_for_effect(effect, effect_files)  # waits for the ack, so no extra pause needed
 
 
 # ---------------------------------------------------------------------- #
@@ -765,15 +1164,11 @@ def error_handler(e: DocDefaultException):
     log.debug(e, exc_info=True)
 
 
-async def main_func():
-    log = logging.getLogger()
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
-    log.addHandler(handler)
-
-    exit_code = 0
+@functools.lru_cache(maxsize=1)
+def _build_parser():
+    """Returns the command line parser, building it on first use only."""
+    import argparse  # only the CLI needs it, so library users don't pay to import it
 
-    # configure command line parser and options
     parser = argparse.ArgumentParser(
         prog="py2saber",
         description='A utility for working with OpenCore-based sabers, based on "sendtosaber" by Nuntis',
@@ -817,6 +1212,11 @@ async def main_func():
         action="store_true",
         help="If one or more specified files do not exist, continue processing the remaining files (otherwise program will exit)",  # noqa: E501
     )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help="Serial port the saber is connected to, skipping auto-detection (default: $PY2SABER_PORT)",
+    )
     parser.add_argument(
         "-D", "--debug", action="store_true", help="Show debugging information"
     )
@@ -858,17 +1258,128 @@ async def main_func():
         dest="cmd",
         help="Send literal command CMD to saber (NOTE: only use if you know what you are doing!)",
     )
+    return parser
+
 
-    args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
+async def main_func():
+    log = logging.getLogger()
+    if not log.handlers:  # don't stack up duplicate handlers if main_func is run more than once
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        log.addHandler(handler)
+
+    exit_code = 0
+
+    args = _build_parser().parse_args(args=None if sys.argv[1:] else ["--help"])
+    if args.port is None:  # read here rather than as the parser default, since the parser is reused
+        args.port = os.environ.get("PY2SABER_PORT")
 
     if args.debug:
         log.setLevel(logging.DEBUG)
 
     # Find port that Anima is connected to
+    sc = None
     try:
+        # Options like -D or -w on their own don't need the saber, so show the help (as for no options) rather than
+        # searching for it
+        if not (args.info or args.list or args.config or args.cmd or args.files or args.erase_all or args.set_effects):
+            _build_parser().print_help()
+            return
+
+        # Nobody can answer the erase prompt if stdin is piped or redirected, so refuse up front rather than after
+        # finding the saber
+        if args.erase_all and not args.yes and not (sys.stdin and sys.stdin.isatty()):
+            log.error("Refusing to erase all files without --yes when not running interactively.")
+            exit_code = 1
+            return
+
+        # Check the files before looking for the saber, so a typo doesn't cost a port scan
+        if args.files:
+            # for Windows, we need to manually expand any wildcards in the input list
+            if _SYSTEM == "Windows":
+                import fnmatch  # only needed here, so don't pay for them on every run
+                import glob
+
+                log.debug(
+                    "Windows system detected. Expanding any wildcards in file names."
+                )
+
+                # Plain file names are passed straight through, leaving the existence check below as their only stat.
+                # Wildcards in the file name part are matched against a listing of the folder, which is read only once
+                # however many patterns point into it (e.g. *.raw *.wav).
+                listings = {}
+
+                def _expand(pattern):
+                    if not glob.has_magic(pattern):
+                        return [pattern]
+                    directory, name = os.path.split(pattern)
+                    if glob.has_magic(directory):  # wildcards in folder names need glob's directory walk
+                        return list(glob.iglob(pattern))
+                    if directory not in listings:
+                        try:
+                            with os.scandir(directory or os.curdir) as entries:
+                                listings[directory] = [entry.name for entry in entries]
+                        except OSError:
+                            listings[directory] = []
+                    names = listings[directory]
+                    if not name.startswith("."):  # like glob, leave out hidden files unless asked for
+                        names = [n for n in names if not n.startswith(".")]
+                    return [os.path.join(directory, n) for n in fnmatch.filter(names, name)]
+
+                args.files = await asyncio.to_thread(
+                    lambda: [match for pattern in args.files for match in _expand(pattern)]
+                )
+                log.debug("Expanded files: %s", args.files)
+
+            # verify that files exist. Each directory is listed once, in a worker thread, rather than stat'ing every
+            # file in it separately. The sizes are kept for the upload, so it doesn't need to stat them again.
+            def _scan(directory, paths):
+                wanted = {}
+                for path in paths:
+                    wanted.setdefault(os.path.normcase(os.path.basename(path)), []).append(path)
+                sizes = {}
+                try:
+                    with os.scandir(directory or os.curdir) as entries:
+                        for entry in entries:
+                            if (found := wanted.get(os.path.normcase(entry.name))) and entry.is_file():
+                                size = entry.stat().st_size  # free on Windows, which caches it in the entry
+                                sizes.update((path, size) for path in found)
+                except OSError:
+                    pass  # e.g. a search-only directory; the stat below still finds its files
+                # The listing only confirms files. Anything it didn't match (unlistable directory, case-insensitive
+                # macOS names, Unicode normalization, Windows 8.3 names...) gets an ordinary stat, as isfile() would.
+                for path in paths:
+                    if path not in sizes:
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        if stat.S_ISREG(st.st_mode):
+                            sizes[path] = st.st_size
+                return sizes
+
+            files_by_dir = {}
+            for file in args.files:
+                files_by_dir.setdefault(os.path.dirname(file), []).append(file)
+            file_sizes = {}
+            for sizes in await asyncio.gather(
+                *(asyncio.to_thread(_scan, directory, paths) for directory, paths in files_by_dir.items())
+            ):
+                file_sizes.update(sizes)
+            verified_files = [file for file in args.files if file in file_sizes]
+            missing_files = [file for file in args.files if file not in file_sizes]
+            for file in missing_files:
+                log.error("File not found: %s", file)
+            if missing_files and not args.continue_on_file_not_found:
+                print("Aborting operation.")
+                exit_code = 1
+                return  # the finally block below closes the port and exits with exit_code
+            plural = "s" if len(verified_files) != 1 else ""  # describe the files actually being sent
+            print(f"\nPreparing to upload file{plural} to saber.")
+
         print("Searching for OpenCore saber.")
         sc = await Saber_Controller.create(
-            loglevel=logging.DEBUG if args.debug else logging.ERROR
+            args.port, loglevel=logging.DEBUG if args.debug else logging.ERROR
         )
         print(f"OpenCore saber found on port {sc.port}")
 
@@ -882,23 +1393,19 @@ async def main_func():
 
         if args.list:  # list files on saber
             print("\nRetrieving list of files on saber.")
-            file_list = await sc.list_files_on_saber_as_bytes()
-            print(file_list.decode().strip())
+            async for line in sc.iter_files_on_saber():
+                print(line)
 
         if args.config:
             print("\nRetrieving config.ini from saber")
             config = await sc.read_config_ini()
-            print("Config.ini:\n")
-            print(config)
+            print(f"Config.ini:\n\n{config}")
 
         if args.cmd:
             print(f"\nSending command to saber: {args.cmd}")
-            await sc.send_command(args.cmd.encode("utf-8"))
-            response = (await sc.read_line()).strip().decode("utf-8")
-            print("Received response: ")
-            while response:
-                print(response)
-                response = (await sc.read_line()).strip().decode("utf-8")
+            await sc.send_command(b"%b\n" % args.cmd.encode("utf-8"))
+            response = await sc.read_until_idle()
+            print(f'Received response: \n{response.decode("utf-8", "replace").strip()}')
             return
 
         if args.set_effects and not args.files:
@@ -906,11 +1413,10 @@ async def main_func():
 
         if args.erase_all:  # erase all files on saber
             print("\n*** This will erase ALL files on the saber! ***")
-            if not args.yes:
-                yorn = input("Do you want to continue? (Y/N): ")
-            else:
-                yorn = "y"
-            if yorn.lower() == "y" or yorn.lower() == "yes":
+            # With --yes there's nothing to ask. The prompt stays a plain input(): nothing else is running on the
+            # event loop, and Ctrl-C must abort straight away; a thread stuck in input() would block exit.
+            confirmed = args.yes or input("Do you want to continue? (Y/N): ").strip().lower() in ("y", "yes")
+            if confirmed:
                 # do the thing
                 print("Erasing all files on saber. This may take several minutes.")
                 await sc.erase_all_files()
@@ -919,49 +1425,13 @@ async def main_func():
                 )
             else:
                 print("Aborting saber erase command.")
-                sys.exit(1)
+                exit_code = 1
+                return
 
         if args.files:  # write file(s) to saber
-            # for Windows, we need to manually expand any wildcards in the input list
-            if platform.system() == "Windows":
-                log.debug(
-                    "Windows system detected. Expanding any wildcards in file names."
-                )
-                expanded_files = []
-                for file in args.files:
-                    expanded_files.extend(glob.glob(file))
-                args.files = expanded_files
-                log.debug(f"Expanded files: {args.files}")
-
-            print(
-                f'\nPreparing to upload file{"s" if len(args.files) > 1 else ""} to saber.'
-            )
-
-            # verify that files exist
-            verified_files = []
-            for file in args.files:
-                try:
-                    if not os.path.isfile(file):
-                        raise FileNotFoundError(
-                            errno.ENOENT, os.strerror(errno.ENOENT), file
-                        )
-                    else:
-                        verified_files.append(file)
-                except FileNotFoundError as e:
-                    log.error(f"File not found: {e.filename}")
-                    if args.continue_on_file_not_found:
-                        continue
-                    else:
-                        print("Aborting operation.")
-                        exit_code = 1
-                        sys.exit(1)
-
-            # send files to saber
             try:
-                await sc.write_files_to_saber(verified_files, add_beep=not args.no_beep)
-                print(
-                    f'\nSuccessfully wrote file{"s" if len(verified_files) > 1 else ""} to saber: {verified_files}'
-                )
+                await sc.write_files_to_saber(verified_files, add_beep=not args.no_beep, sizes=file_sizes)
+                print(f"\nSuccessfully wrote file{plural} to saber: {verified_files}")
                 if not args.no_set_effects:
                     await sc.auto_assign_sound_effects()
             except AnimaFileWriteException as e:
@@ -973,7 +1443,11 @@ async def main_func():
         exit_code = 1
 
     finally:
+        if sc:
+            sc.close()
         if args.wait:
+            from getch import pause_exit  # only needed with --wait
+
             pause_exit(exit_code, "\nPress any key to exit.")
         else:
             sys.exit(exit_code)